@@ -17,175 +17,420 @@ or the file ~/.ionap.conf
 # License: MIT
 # See LICENSE file for details
 
-import argparse
-import configparser
-from datetime import datetime
-import json
+import functools
 import os
+import shutil
 import sys
-import simplejson
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
 
-import requests
+# Modules that are only needed by some of the commands (most notably requests, which
+# takes a significant part of the startup time) or only by the command line interface
+# (argparse) are imported where they are used
+
+# orjson is considerably faster at both parsing and serializing; fall back
+# to the standard library if it is not installed
+try:
+    import orjson
+
+    _loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    import json
+
+    _loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+    def _dumps(obj):
+        return json.dumps(obj, indent=2).encode('utf-8')
 
 API_VERSION = "0.3"
 DEFAULT_BASE_URL = "https://test.ion-ap.net/api/"
 DEFAULT_CONFIG_FILE = os.path.abspath(os.path.expanduser("~/.ion-ap-client.conf"))
+# Identifier scheme that is used when an identifier is given without one
+_ACTORID_PREFIX = "iso6523-actorid-upis::"
+DEFAULT_CONFIG = {
+    'api_key': '<api key>',
+    'api_url': DEFAULT_BASE_URL
+}
+# Size of the chunks in which downloaded documents are written out
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Maximum number of API requests that are performed at the same time
+MAX_CONCURRENT_REQUESTS = 8
+# Maximum number of responses that are kept to revalidate with their ETag
+ETAG_CACHE_SIZE = 64
 
 
 class IonAPClientError(Exception):
     pass
 
 
+def print_json(data):
+    """Print the given data as indented JSON, writing the encoded bytes directly to stdout"""
+    sys.stdout.flush()
+    sys.stdout.buffer.write(_dumps(data))
+    sys.stdout.buffer.write(b"\n")
+
+
+def print_stream(stream):
+    """Print a streamed response body, copying the bytes directly to stdout without decoding them"""
+    sys.stdout.flush()
+    shutil.copyfileobj(stream, sys.stdout.buffer, DOWNLOAD_CHUNK_SIZE)
+    sys.stdout.buffer.write(b"\n")
+
+
+def print_bytes(data):
+    """Print a response body, writing the bytes directly to stdout without decoding them"""
+    sys.stdout.flush()
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.write(b"\n")
+
+
+def split_timestamp(timestamp):
+    """Return the date (YYYY-MM-DD) and time (HH:MM) parts of an ISO 8601 timestamp"""
+    # The API returns timestamps like 2021-01-17T21:37:48.769630Z, so normally the parts can be sliced out directly
+    if len(timestamp) >= 16 and timestamp[10] == 'T':
+        return timestamp[:10], timestamp[11:16]
+    from datetime import datetime
+    try:
+        date = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return timestamp, "-"
+    return date.strftime("%Y-%m-%d"), date.strftime("%H:%M")
+
+
+def print_metadata(metadata):
+    """Print the metadata of a transaction"""
+    print("Sender:   %s::%s" % (metadata["sender_authority"], metadata["sender"]))
+    print("Receiver: %s::%s" % (metadata["receiver_authority"], metadata["receiver"]))
+    print("Type:     %s" % (metadata["document_identification_type"]))
+    print("Process:  %s" % (metadata["business_scope_process_id"]))
+
+
+# Parsed configuration files are cached on their path, modification time (in
+# nanoseconds, so that quick successive edits are not missed) and size, so that
+# creating several clients does not read and parse the file each time
+@functools.lru_cache(maxsize=4)
+def _load_config(path, mtime_ns, size):
+    import configparser
+
+    config = configparser.ConfigParser()
+    config['ionap'] = DEFAULT_CONFIG
+    config.read(path)
+    return {
+        'api_key': config.get('ionap', 'api_key'),
+        'api_url': config.get('ionap', 'api_url')
+    }
+
+
+# This does not need an API key (the point of the default configuration is to set one), so it
+# can be used without a client
+def write_default_config_file(config_file=None):
+    """Write the default configuration to config_file, unless it already exists"""
+    if config_file is None:
+        config_file = DEFAULT_CONFIG_FILE
+    if os.path.exists(config_file):
+        print("Error: %s already exists, not overwriting with defaults" % config_file)
+    else:
+        import configparser
+
+        config = configparser.ConfigParser()
+        config['ionap'] = DEFAULT_CONFIG
+        with open(config_file, "w") as output_file:
+            config.write(output_file)
+            print("Default configuration written to %s" % config_file)
+        os.chmod(config_file, 0o600)
+
+
 class IonAPClient:
-    def __init__(self, config_file=None, json_output=False, verbose=False):
+    # The HTTP methods that are used by the API
+    _METHODS = frozenset({"GET", "POST", "DELETE"})
+
+    def __init__(self, config_file=None, json_output=False, verbose=False, pretty=False):
         self.config_file = config_file
         self.json_output = json_output
         self.verbose = verbose
+        self.pretty = pretty
 
-        self.config = configparser.ConfigParser()
         self.read_config()
 
         os_api_key = os.getenv("IONAP_API_KEY")
         if os_api_key is not None:
             self.api_key = os_api_key
         else:
-            self.api_key = self.config.get('ionap', 'api_key')
+            self.api_key = self._config['api_key']
+        if self.api_key is None or self.api_key == '<api key>':
+            raise IonAPClientError(
+                "API key not set, please create a configuration file or set an environment variable IONAP_API_KEY")
+        self._auth_header = 'Token %s' % self.api_key
 
-        self.api_url = self.config.get('ionap', 'api_url')
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry, make_headers
+
+        self.api_url = self._config['api_url']
         if not self.api_url.endswith('/'):
             self.api_url += '/'
         self.api_url += "%s/" % API_VERSION
 
+        # Use one session for all requests, so that connections (and their
+        # TLS handshakes) are reused between calls. The default headers are
+        # set on the session, requests only need to pass headers they override
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': self._auth_header,
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            # Ask for compressed responses, with every encoding that urllib3 can
+            # decode here (this includes brotli if it is installed)
+            'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding']
+        })
+        # Retry on connection errors, and on responses that indicate the API is briefly unavailable or
+        # rate limited (urllib3 does not retry POST requests on these, so documents are not sent twice).
+        # A 500 is not retried, as it is usually not transient.
+        # When the retries run out, the last response is returned and handled like any other error response
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504],
+                      raise_on_status=False)
+        # Keep one connection per concurrent request open (request_all() never runs more than that at
+        # the same time, so its requests always find a pooled connection)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_REQUESTS, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Bodies of earlier GET responses that had an ETag, as (etag, content, content type) by path and query.
+        # When the same request is made again (such as when polling a listing), an unchanged result only
+        # costs a 304 response without a body. The least recently used entries are dropped once there are
+        # ETAG_CACHE_SIZE of them; the lock is needed as request_all() makes requests from several threads
+        self._etag_cache = OrderedDict()
+        self._etag_lock = threading.Lock()
+
+    # The full configuration file as a ConfigParser, for callers that need more than the API key and
+    # URL. It is only parsed when it is used, the client itself works from the cached values
+    @functools.cached_property
+    def config(self):
+        import configparser
+
+        config = configparser.ConfigParser()
+        config['ionap'] = DEFAULT_CONFIG
+        config.read(self.config_file)
+        return config
+
+    def close(self):
+        """Close the connections that are kept open by the client"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def read_config(self):
         if self.config_file is None:
             self.config_file = DEFAULT_CONFIG_FILE
-        self.config['ionap'] = {
-            'api_key': '<api key>',
-            'api_url': DEFAULT_BASE_URL
-        }
-        if os.path.exists(self.config_file):
-            self.config.read(self.config_file)
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            # Also covers paths that cannot be checked at all, such as one below a file or an unreadable directory
+            self._config = dict(DEFAULT_CONFIG)
             if self.verbose:
-                print("Read configuration file %s" % self.config_file)
+                sys.stderr.write("Configuration file %s does not exist, not reading configuration\n" % self.config_file)
         else:
+            # The parsed values are shared with every client that reads the same file, so each client
+            # gets its own copy
+            self._config = dict(_load_config(self.config_file, st.st_mtime_ns, st.st_size))
             if self.verbose:
-                print("Configuration file %s does not exist, not reading configuration" % self.config_file)
+                sys.stderr.write("Read configuration file %s\n" % self.config_file)
 
     #
     # Helper methods
     #
     # Set json_response=False if you are not calling the API with accept:application/json, but downloading data,
     # such as XML documents
-    def request(self, method, path, data=None, headers=None, json_response=True):
-        if self.api_key is None or self.api_key == '<api key>':
-            raise IonAPClientError(
-                "API key not set, please create a configuration file or set an environment variable IONAP_API_KEY")
-
-        if headers is None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json'
-            }
-        headers['Authorization'] = 'Token %s' % self.api_key
-
-        url = "%s%s" % (self.api_url, path)
+    # Set stream=True to get the response body as a file-like object that is read from the connection,
+    # instead of the decoded response
+    # Query parameters can be given as a dict in params, these are encoded and added to the path
+    # Error responses are printed to error_output, which is stdout unless another file is given
+    def request(self, method, path, data=None, headers=None, json_response=True, stream=False, params=None,
+                error_output=None):
+        if method not in self._METHODS:
+            raise IonAPClientError("Unsupported request method: %s" % method)
+
+        # api_url always ends with a slash, and paths are relative to it
+        url = self.api_url + path
+
+        # If an earlier GET of the same path had an ETag, ask the server to only send the body if it changed.
+        # Only requests with the session's default headers are cached, as other headers (such as Accept)
+        # can select a different representation that the cache key does not account for
+        cache_key = None
+        cached = None
+        if method == "GET" and not stream and headers is None:
+            cache_key = (path, urlencode(params) if params else None)
+            with self._etag_lock:
+                cached = self._etag_cache.get(cache_key)
+                if cached is not None:
+                    self._etag_cache.move_to_end(cache_key)
+            if cached is not None:
+                headers = {'If-None-Match': cached[0]}
 
         if self.verbose:
-            print("Request: %s %s" % (method, url))
-            print("Headers:")
-            for k, v in headers.items():
+            # Verbose output goes to stderr in one write, so it does not get mixed with the actual output.
+            # The headers that are sent are the session headers, overridden by those given here
+            request_headers = self.session.headers.copy()
+            if headers is not None:
+                request_headers.update(headers)
+            if params:
+                lines = ["Request: %s %s?%s" % (method, url, urlencode(params)), "Headers:"]
+            else:
+                lines = ["Request: %s %s" % (method, url), "Headers:"]
+            for k, v in request_headers.items():
                 # Print all tokens as-is, except the authorization token
                 if k == "Authorization":
-                    print("  Authorization: Token <api key>")
+                    lines.append("  Authorization: Token <api key>")
                 else:
-                    print("  %s: %s" % (k, v))
-
-        if method == "GET":
-            response = requests.get(url, headers=headers)
-        elif method == "POST":
-            response = requests.post(url, data=data, headers=headers)
-        elif method == "DELETE":
-            response = requests.delete(url, headers=headers)
-        else:
-            raise IonAPClientError("Did not get a response object from requests library")
+                    lines.append("  %s: %s" % (k, v))
+            sys.stderr.write("\n".join(lines) + "\n")
 
-        if 200 <= response.status_code < 300:
-            try:
-                if json_response:
-                    response_data = response.json()
-                    if self.json_output:
-                        print(json.dumps(response_data, indent=2))
-                        return None
-                else:
-                    response_data = response.content.decode('utf-8')
-            except simplejson.decoder.JSONDecodeError:
-                response_data = response.content.decode('utf-8')
-            return response_data
+        response = self.session.request(method, url, params=params, data=data, headers=headers, stream=stream)
+        if self.verbose:
+            sys.stderr.write("Response: %d (Content-Encoding: %s)\n" % (
+                response.status_code, response.headers.get('Content-Encoding', 'none')))
+
+        if 200 <= response.status_code < 300 or (response.status_code == 304 and cached is not None):
+            if stream:
+                # Read straight from urllib3's response, which undoes any content encoding while reading
+                # and puts the connection back in the pool once the body has been read
+                response.raw.decode_content = True
+                return response.raw
+            if response.status_code == 304:
+                # Not modified, use the body of the earlier response
+                _, content, content_type = cached
+            else:
+                content = response.content
+                content_type = response.headers.get('Content-Type', '')
+                if cache_key is not None and 'ETag' in response.headers:
+                    with self._etag_lock:
+                        self._etag_cache[cache_key] = (response.headers['ETag'], content, content_type)
+                        self._etag_cache.move_to_end(cache_key)
+                        if len(self._etag_cache) > ETAG_CACHE_SIZE:
+                            self._etag_cache.popitem(last=False)
+            # Only parse the body if the server says it is JSON, anything else (including an empty body,
+            # such as that of a 204 response) is returned as text
+            is_json = bool(content) and content_type.startswith('application/json')
+            if json_response and self.json_output:
+                if is_json and self.pretty:
+                    print_json(_loads(content))
+                elif content:
+                    # The response is printed as-is, there is no need to parse it (unless it is to be indented)
+                    print_bytes(content)
+                return None
+            if json_response and is_json:
+                return _loads(content)
+            return content.decode('utf-8')
         else:
-            print("Error response: %d" % response.status_code)
             try:
-                response_data = response.json()
-                print(json.dumps(response_data, indent=2))
-            except simplejson.decoder.JSONDecodeError:
-                response_data = response.content.decode('utf-8')
-                print(response_data)
+                body = _dumps(_loads(response.content)).decode('utf-8')
+            except JSONDecodeError:
+                body = response.content.decode('utf-8')
+            # The message is written in one go, so that it does not get mixed with the errors of other
+            # requests that are made at the same time
+            (error_output or sys.stdout).write("Error response: %d\n%s\n" % (response.status_code, body))
             return None
 
+    # Retrieve one or more consecutive pages of a transaction listing, and merge them into one result.
+    # The first page is retrieved on its own, so that no pages past the end of the listing are requested;
+    # the remaining pages are then retrieved concurrently
+    def list_pages(self, path, page, page_size, pages=1):
+        def page_params(page_number):
+            return {'page': page_number, 'page_size': page_size}
+
+        if page_size < 1:
+            raise IonAPClientError("The page size must be at least 1")
+        result = self.request("GET", path, params=page_params(page))
+        if not result or pages <= 1:
+            return result
+        total = result["count"]
+        last_page = min(page + pages - 1, (total + page_size - 1) // page_size)
+        page_numbers = range(page + 1, last_page + 1)
+        results = [result] + self.request_all([path] * len(page_numbers),
+                                              [page_params(page_number) for page_number in page_numbers])
+        return {
+            "count": total,
+            "results": [element for page_result in results if page_result for element in page_result["results"]]
+        }
+
+    # Perform GET requests on all the given paths concurrently, over the shared session.
+    # The results are returned in the same order as the paths. If given, params is a list with the query
+    # parameters for each of the paths
+    def request_all(self, paths, params=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if params is None:
+            params = [None] * len(paths)
+        if self.json_output:
+            # The responses are printed by request() itself, get them one by one to keep the output in order
+            return [self.request("GET", path, params=path_params) for path, path_params in zip(paths, params)]
+        # Errors go to stderr; the results themselves are only printed once all requests are done
+        def get(path, path_params):
+            return self.request("GET", path, params=path_params, error_output=sys.stderr)
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            return list(executor.map(get, paths, params))
+
     def write_default_config(self):
-        if os.path.exists(self.config_file):
-            print("Error: %s already exists, not overwriting with defaults" % self.config_file)
-        else:
-            with open(self.config_file, "w") as output_file:
-                self.config.write(output_file)
-                print("Default configuration written to %s" % self.config_file)
-            os.chmod(self.config_file, 0o600)
+        write_default_config_file(self.config_file)
 
     #
     # Main functionality
     #
+    # The document data can be given as bytes, or as a file opened in binary mode. A file is streamed
+    # to the server while it is being read, rather than read into memory first; requests sets its
+    # Content-Length if the size is known (a regular file), and otherwise (a pipe) sends it chunked
+    @staticmethod
+    def _document_headers(document_data):
+        headers = {'Content-Type': 'application/xml'}
+        if isinstance(document_data, bytes):
+            headers['Content-Length'] = str(len(document_data))
+        return headers
+
     def send_document(self, document_data, args):
         path = "send/document/"
-        params = []
+        params = {}
         if args.sender:
-            sender = args.sender
-            if sender.find("::") < 0:
-                sender = "iso6523-actorid-upis::%s" % sender
-            params.append("sender=%s" % sender)
+            if "::" in args.sender:
+                params["sender"] = args.sender
+            else:
+                params["sender"] = _ACTORID_PREFIX + args.sender
         if args.receiver:
-            receiver = args.receiver
-            if receiver.find("::") < 0:
-                receiver = "iso6523-actorid-upis::%s" % receiver
-            params.append("receiver=%s" % receiver)
+            if "::" in args.receiver:
+                params["receiver"] = args.receiver
+            else:
+                params["receiver"] = _ACTORID_PREFIX + args.receiver
         if args.process_id:
-            params.append("process_id=%s" % args.process_id)
+            params["process_id"] = args.process_id
         if args.action_id:
-            params.append("action_id=%s" % args.action_id)
+            params["action_id"] = args.action_id
         if args.document_id:
-            params.append("document_id=%s" % args.document_id)
-        if len(params) > 0:
-            path += "?%s" % "&".join(params)
+            params["document_id"] = args.document_id
         method = "POST"
-        headers = {
-            'Content-Type': 'application/xml',
-            'Accept': 'application/json'
-        }
-        result = self.request(method, path, data=document_data, headers=headers)
+        headers = self._document_headers(document_data)
+        result = self.request(method, path, data=document_data, headers=headers, params=params)
         return result
 
     def send_sbdh(self, document_data):
         path = "send/sbdh/"
         method = "POST"
-        headers = {
-            'Content-Type': 'application/xml',
-            'Accept': 'application/json'
-        }
+        headers = self._document_headers(document_data)
         result = self.request(method, path, data=document_data, headers=headers)
         return result
 
-    def send_status_list(self, page, page_size):
-        path = "send/transactions/?page=%d&page_size=%d" % (page, page_size)
-        method = "GET"
-        result = self.request(method, path)
+    def send_status_list(self, page, page_size, details=False, pages=1):
+        path = "send/transactions/"
+        result = self.list_pages(path, page, page_size, pages)
         if result:
             elements = result["results"]
             total = result["count"]
@@ -196,9 +441,24 @@ class IonAPClient:
                 first = 0
                 last = 0
 
-            print("Showing %d-%d of %d transactions" % (first, last, total))
-            for element in elements:
-                print("%s\t%s\t%s" % (element["transaction_id"], element["status"], element["created_on"]))
+            # Collect all output lines and write them at once, rather than printing every row separately
+            lines = ["Showing %d-%d of %d transactions\n" % (first, last, total)]
+            if details:
+                metadata = self.request_all(["send/transactions/%s/metadata/" % element["transaction_id"]
+                                             for element in elements])
+                for element, element_metadata in zip(elements, metadata):
+                    if element_metadata:
+                        receiver = "%s::%s" % (element_metadata["receiver_authority"], element_metadata["receiver"])
+                        document_type = element_metadata["document_identification_type"]
+                    else:
+                        receiver = "-"
+                        document_type = "-"
+                    lines.append("%s\t%s\t%s\t%s\t%s\n" % (element["transaction_id"], element["status"],
+                                                          element["created_on"], receiver, document_type))
+            else:
+                lines.extend("%s\t%s\t%s\n" % (element["transaction_id"], element["status"], element["created_on"])
+                             for element in elements)
+            sys.stdout.write("".join(lines))
 
     def send_status_single(self, transaction_id):
         path = "send/transactions/%s" % transaction_id
@@ -207,39 +467,46 @@ class IonAPClient:
         if result:
             print("%s\t%s\t%s" % (result["transaction_id"], result["status"], result["created_on"]))
 
+    # Show the status and the metadata of a transaction, retrieving both at the same time
+    def send_status_full(self, transaction_id):
+        result, metadata = self.request_all(["send/transactions/%s" % transaction_id,
+                                             "send/transactions/%s/metadata/" % transaction_id])
+        if result:
+            print("%s\t%s\t%s" % (result["transaction_id"], result["status"], result["created_on"]))
+        if metadata:
+            print_metadata(metadata)
+
     def send_status_document(self, transaction_id):
         path = "send/transactions/%s/document" % transaction_id
         method = "GET"
         headers = {'Accept': 'application/xml'}
-        document = self.request(method, path, headers=headers)
-        print(document)
+        document = self.request(method, path, headers=headers, json_response=False, stream=True)
+        if document is not None:
+            print_stream(document)
 
     def send_status_receipt(self, transaction_id):
         path = "send/transactions/%s/receipt" % transaction_id
         method = "GET"
         headers = {'Accept': 'application/xml'}
-        document = self.request(method, path, headers=headers)
-        print(document)
+        document = self.request(method, path, headers=headers, json_response=False, stream=True)
+        if document is not None:
+            print_stream(document)
 
     def send_status_metadata(self, transaction_id):
         path = "send/transactions/%s/metadata/" % transaction_id
         method = "GET"
         result = self.request(method, path)
         if result:
-            print("Sender:   %s::%s" % (result["sender_authority"], result["sender"]))
-            print("Receiver: %s::%s" % (result["receiver_authority"], result["receiver"]))
-            print("Type:     %s" % (result["document_identification_type"]))
-            print("Process:  %s" % (result["business_scope_process_id"]))
+            print_metadata(result)
 
     def send_status_delete(self, transaction_id):
         path = "send/transactions/%s/" % transaction_id
         method = "DELETE"
         self.request(method, path)
 
-    def receive_list(self, page, page_size):
-        path = "receive/transactions/?page=%d&page_size=%d" % (page, page_size)
-        method = "GET"
-        result = self.request(method, path)
+    def receive_list(self, page, page_size, details=False, pages=1):
+        path = "receive/transactions/"
+        result = self.list_pages(path, page, page_size, pages)
         if result:
             elements = result["results"]
             total = result["count"]
@@ -250,27 +517,35 @@ class IonAPClient:
                 first = 0
                 last = 0
 
-            print("Showing %d-%d of %d transactions" % (first, last, total))
-            for element in elements:
+            # Collect all output lines and write them at once, rather than printing every row separately
+            lines = ["Showing %d-%d of %d transactions\n" % (first, last, total)]
+            if details:
+                metadata = self.request_all(["receive/transactions/%s/metadata/" % element["transaction_id"]
+                                             for element in elements])
+            else:
+                metadata = [None] * len(elements)
+            for element, element_metadata in zip(elements, metadata):
                 #print("%s\t%s\t%s" % (element["transaction_id"], element["status"], element["created_on"]))
-                date_str = element["created_on"].replace("Z", "+00:00")
-                
-                date = datetime.fromisoformat(date_str)
-                day = date.strftime("%Y-%m-%d")
-                time = date.strftime("%H:%M")
+                day, time = split_timestamp(element["created_on"])
                 if "document_sender_name" in element:
                     name = element["document_sender_name"]
                 else:
                     name = "-"
-                print("%s %s %s %s %s %s %s" % (
+                line = "%s %s %s %s %s %s %s" % (
                     day, time,
                     element.get("document_sender"),
                     name,
                     element["document_identification_type"],
                     element["transaction_id"],
                     element["status"],
-                ))
-                #print(date.strftime("%Y-%m-%d"))
+                )
+                if element_metadata:
+                    line += " %s::%s %s" % (element_metadata["receiver_authority"], element_metadata["receiver"],
+                                            element_metadata["business_scope_process_id"])
+                elif details:
+                    line += " - -"
+                lines.append(line + "\n")
+            sys.stdout.write("".join(lines))
 
     def receive_single(self, transaction_id):
         path = "receive/transactions/%s" % transaction_id
@@ -279,29 +554,37 @@ class IonAPClient:
         if result:
             print("%s\t%s\t%s" % (result["transaction_id"], result["status"], result["created_on"]))
 
+    # Show the status and the metadata of a transaction, retrieving both at the same time
+    def receive_full(self, transaction_id):
+        result, metadata = self.request_all(["receive/transactions/%s" % transaction_id,
+                                             "receive/transactions/%s/metadata/" % transaction_id])
+        if result:
+            print("%s\t%s\t%s" % (result["transaction_id"], result["status"], result["created_on"]))
+        if metadata:
+            print_metadata(metadata)
+
     def receive_document(self, transaction_id):
         path = "receive/transactions/%s/document" % transaction_id
         method = "GET"
         headers = {'Accept': 'application/xml'}
-        document = self.request(method, path, headers=headers, json_response=False)
-        print(document)
+        document = self.request(method, path, headers=headers, json_response=False, stream=True)
+        if document is not None:
+            print_stream(document)
 
     def receive_receipt(self, transaction_id):
         path = "receive/transactions/%s/receipt" % transaction_id
         method = "GET"
         headers = {'Accept': 'application/xml'}
-        document = self.request(method, path, headers=headers)
-        print(document)
+        document = self.request(method, path, headers=headers, json_response=False, stream=True)
+        if document is not None:
+            print_stream(document)
 
     def receive_metadata(self, transaction_id):
         path = "receive/transactions/%s/metadata/" % transaction_id
         method = "GET"
         result = self.request(method, path)
         if result:
-            print("Sender:   %s::%s" % (result["sender_authority"], result["sender"]))
-            print("Receiver: %s::%s" % (result["receiver_authority"], result["receiver"]))
-            print("Type:     %s" % (result["document_identification_type"]))
-            print("Process:  %s" % (result["business_scope_process_id"]))
+            print_metadata(result)
 
     def receive_delete(self, transaction_id):
         path = "receive/transactions/%s/" % transaction_id
@@ -309,109 +592,97 @@ class IonAPClient:
         self.request(method, path)
 
 
-class CommandLine:
+#
+# Command-line parser, this is created once and reused
+#
+def _add_global_options(parser, suppress=False):
+    # The global options are accepted both before and after the main command. The copies on the
+    # command parsers must not set defaults, or they would override values given before the command
+    import argparse
 
-    def __init__(self):
-        parser = argparse.ArgumentParser(
-            description="ion-AP API client",
-            usage="""ionap_client.py <main command> [<args>]
-
-Main commands:
-    send            Send document (derive SBDH)
-    send_sbdh       Send document which already includes SBDH
-    send_status     View and retrieve the status and details of outgoing
-                    transactions and documents
-    receive         View and retrieve the status and details of incoming
-                    transactions and documents
-    create_config   Create an initial default config file
-
-Use ion_ap_client <main command> -h for more details about the specific command.
-    """)
-        parser.add_argument("command", help="The main command to run")
-        parser.add_argument("-c", "--config", help="Use the specified configuration file")
-        parser.add_argument("-j", "--json", action="store_true", help="Print output as JSON")
-        parser.add_argument("-v", "--verbose", action="store_true",
-                            help="Verbose mode, print API actions and sent data as well")
-
-        # Get the global options and command argument from sys
-        main_args = []
-        self.rest_args = []
-        main_command_read = False
-
-        args = sys.argv[1:]
-        while len(args) > 0:
-            arg = args.pop(0)
-            if arg in ['-c', '--config']:
-                main_args.append(arg)
-                if len(args) > 0:
-                    main_args.append(args.pop(0))
-            elif arg in ['-j', '--json', '-v', '--verbose'] and arg not in main_args:
-                main_args.append(arg)
-            elif not main_command_read:
-                main_args.append(arg)
-                main_command_read = True
-            else:
-                self.rest_args.append(arg)
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+    parser.add_argument("-c", "--config", help="Use the specified configuration file", default=default(None))
+    parser.add_argument("-j", "--json", action="store_true", help="Print output as JSON", default=default(False))
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose mode, print API actions and sent data as well", default=default(False))
+    parser.add_argument("--pretty", action="store_true", help="Indent the JSON output of --json",
+                        default=default(False))
 
-        args = parser.parse_args(main_args)
 
-        # use dispatch pattern to invoke method with same name
-        try:
-            cmd = getattr(self, args.command)
-        except AttributeError:
-            print("Unknown command: %s" % args.command)
-            sys.exit(2)
-
-        self.api_client = IonAPClient(args.config, args.json, args.verbose)
-        cmd()
-
-    def send(self):
-        parser = argparse.ArgumentParser(
-            description="ion-AP API send document",
-            usage="""ionap_client.py send <filename> [<args>]
-""")
-        parser.add_argument("filename", help="The XML document to send")
-        parser.add_argument("--sender",
-                            help="The sender identifier (in the form 0106:12345678 or "
-                                 "iso6523-actorid-upis::0106:12345678")
-        parser.add_argument("--receiver",
-                            help="The receiver identifier (in the form 0106:12345678 or "
-                                 "iso6523-actorid-upis::0106:12345678")
-        parser.add_argument("--process-id",
-                            help="The process id (such as "
-                                 "urn:fdc:peppol.eu:2017:poacc:billing:01:1.0)")
-        parser.add_argument("--action-id",
-                            help="The action id (leave blank for Peppol)")
-        parser.add_argument("--document-id",
-                            help="The full document id (document type, root element, "
-                                 "customization id and version)")
-
-        args = parser.parse_args(self.rest_args)
-
-        with open(args.filename, 'r') as infile:
-            document_data = infile.read()
-        result = self.api_client.send_document(document_data, args)
-        if result:
-            print("Status: %s Transaction id %s" % (result["status"], result["transaction_id"]))
+def _positive_int(value):
+    """Argument type for numbers that must be at least 1"""
+    import argparse
 
-    def send_sbdh(self):
-        parser = argparse.ArgumentParser(
-            description="ion-AP API send document (full SBDH)",
-            usage="""ionap_client.py send <filename> [<args>]
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a number: %r" % value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not %d" % number)
+    return number
+
+
+def _add_list_options(parser):
+    parser.add_argument("-p", "--page", help="The page to show when listing transactions", type=int, default=1)
+    parser.add_argument("-s", "--page-size", help="The number of items to show when listing transactions",
+                        type=_positive_int, default=10)
+    parser.add_argument("--pages", help="The number of consecutive pages to show when listing transactions, "
+                                         "starting at --page. These are retrieved concurrently. With --json, "
+                                         "only the first page is shown", type=_positive_int, default=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="ion-AP API client",
+        usage="ionap_client.py <main command> [<args>]",
+        epilog="Use ion_ap_client <main command> -h for more details about the specific command.")
+    _add_global_options(parser)
+    commands = parser.add_subparsers(dest="command", metavar="<main command>", title="main commands")
+    commands.required = True
+
+    send = commands.add_parser(
+        "send",
+        help="Send document (derive SBDH)",
+        description="ion-AP API send document",
+        usage="""ionap_client.py send <filename> [<args>]
 """)
-        parser.add_argument("filename", help="The XML document to send")
-
-        args = parser.parse_args(self.rest_args)
-        with open(args.filename, 'r') as infile:
-            document_data = infile.read()
-        result = self.api_client.send_sbdh(document_data)
-        if result:
-            print("Status: %s Transaction id %s" % (result["status"], result["transaction_id"]))
+    _add_global_options(send, suppress=True)
+    send.add_argument("filename", help="The XML document to send")
+    send.add_argument("--sender",
+                      help="The sender identifier (in the form 0106:12345678 or "
+                           "iso6523-actorid-upis::0106:12345678")
+    send.add_argument("--receiver",
+                      help="The receiver identifier (in the form 0106:12345678 or "
+                           "iso6523-actorid-upis::0106:12345678")
+    send.add_argument("--process-id",
+                      help="The process id (such as "
+                           "urn:fdc:peppol.eu:2017:poacc:billing:01:1.0)")
+    send.add_argument("--action-id",
+                      help="The action id (leave blank for Peppol)")
+    send.add_argument("--document-id",
+                      help="The full document id (document type, root element, "
+                           "customization id and version)")
+    send.set_defaults(func=CommandLine.send)
+
+    send_sbdh = commands.add_parser(
+        "send_sbdh",
+        help="Send document which already includes SBDH",
+        description="ion-AP API send document (full SBDH)",
+        usage="""ionap_client.py send_sbdh <filename> [<args>]
+""")
+    _add_global_options(send_sbdh, suppress=True)
+    send_sbdh.add_argument("filename", help="The XML document to send")
+    send_sbdh.set_defaults(func=CommandLine.send_sbdh)
 
-    def send_status(self):
-        parser = argparse.ArgumentParser(
-            description="ion-AP API send operations",
-            usage="""ionap_client.py send_status <transaction> <command> [<args>]
+    send_status = commands.add_parser(
+        "send_status",
+        help="View and retrieve the status and details of outgoing transactions and documents",
+        description="ion-AP API send operations",
+        usage="""ionap_client.py send_status <transaction> <command> [<args>]
 
 Commands:
   document: Retrieve the XML document that was sent
@@ -419,36 +690,25 @@ Commands:
   metadata: Retrieve metadata of the transaction (sender, receiver, etc.)
   delete: Delete the transaction
 """)
-        parser.add_argument("transaction",
-                            help="The transaction ID to get information or data from, "
-                                 "or a command. Leave empty for a list of send transactions",
-                            nargs='?')
-        parser.add_argument("command", help="A command to run on the transaction", nargs='?')
-        parser.add_argument("-p", "--page", help="The page to show when listing transactions", type=int, default=1)
-        parser.add_argument("-s", "--page-size", help="The number of items to show when listing transactions", type=int,
-                            default=10)
-        args = parser.parse_args(self.rest_args)
-
-        if args.transaction is None:
-            self.api_client.send_status_list(page=args.page, page_size=args.page_size)
-        else:
-            if args.command is None:
-                self.api_client.send_status_single(args.transaction)
-            elif args.command == "document":
-                self.api_client.send_status_document(args.transaction)
-            elif args.command == "receipt":
-                self.api_client.send_status_receipt(args.transaction)
-            elif args.command == "metadata":
-                self.api_client.send_status_metadata(args.transaction)
-            elif args.command == "delete":
-                self.api_client.send_status_delete(args.transaction)
-            else:
-                print("Unknown command: %s" % args.command)
-
-    def receive(self):
-        parser = argparse.ArgumentParser(
-            description="ion-AP API receive operations",
-            usage="""ionap_client.py receive <transaction id> <command> [<args>]
+    _add_global_options(send_status, suppress=True)
+    send_status.add_argument("transaction",
+                             help="The transaction ID to get information or data from, "
+                                  "or a command. Leave empty for a list of send transactions",
+                             nargs='?')
+    send_status.add_argument("transaction_command", metavar="command", help="A command to run on the transaction",
+                             nargs='?')
+    _add_list_options(send_status)
+    send_status.add_argument("-f", "--full", action="store_true",
+                             help="When showing a single transaction, also show its metadata")
+    send_status.add_argument("-d", "--details", action="store_true",
+                             help="Also show the receiver and document type when listing transactions")
+    send_status.set_defaults(func=CommandLine.send_status)
+
+    receive = commands.add_parser(
+        "receive",
+        help="View and retrieve the status and details of incoming transactions and documents",
+        description="ion-AP API receive operations",
+        usage="""ionap_client.py receive <transaction id> <command> [<args>]
 
 Commands:
   document: Retrieve the XML document that was sent
@@ -456,35 +716,97 @@ Commands:
   metadata: Retrieve metadata of the transaction (sender, receiver, etc.)
   delete: Delete the transaction
 """)
-        parser.add_argument("transaction",
-                            help="The transaction ID to get information or data from. "
-                                 "Leave empty for a list of transactions",
-                            nargs='?')
-        parser.add_argument("command", help="A command to run on the transaction", nargs='?')
-        parser.add_argument("-p", "--page", help="The page to show when listing transactions", type=int, default=1)
-        parser.add_argument("-s", "--page-size", help="The number of items to show when listing transactions", type=int,
-                            default=10)
-        # parser.add_argument("--json", action="store_true", help="Print output as JSON")
-        args = parser.parse_args(self.rest_args)
+    _add_global_options(receive, suppress=True)
+    receive.add_argument("transaction",
+                         help="The transaction ID to get information or data from. "
+                              "Leave empty for a list of transactions",
+                         nargs='?')
+    receive.add_argument("transaction_command", metavar="command", help="A command to run on the transaction",
+                         nargs='?')
+    _add_list_options(receive)
+    receive.add_argument("-f", "--full", action="store_true",
+                         help="When showing a single transaction, also show its metadata")
+    receive.add_argument("-d", "--details", action="store_true",
+                         help="Also show the receiver and process id when listing transactions")
+    receive.set_defaults(func=CommandLine.receive)
+
+    create_config = commands.add_parser(
+        "create_config",
+        help="Create an initial default config file",
+        description="ion-AP API client configuration")
+    _add_global_options(create_config, suppress=True)
+    create_config.set_defaults(func=CommandLine.create_config)
+
+    return parser
+
+
+class CommandLine:
+    # The client methods to call for the commands on a single transaction,
+    # where no command shows the status of the transaction
+    _SEND_STATUS_COMMANDS = {
+        None: IonAPClient.send_status_single,
+        "document": IonAPClient.send_status_document,
+        "receipt": IonAPClient.send_status_receipt,
+        "metadata": IonAPClient.send_status_metadata,
+        "delete": IonAPClient.send_status_delete,
+    }
+    _RECEIVE_COMMANDS = {
+        None: IonAPClient.receive_single,
+        "document": IonAPClient.receive_document,
+        "receipt": IonAPClient.receive_receipt,
+        "metadata": IonAPClient.receive_metadata,
+        "delete": IonAPClient.receive_delete,
+    }
+
+    def __init__(self):
+        args = _parser().parse_args()
 
+        # Creating the configuration is the only command that does not use the API
+        if args.func is CommandLine.create_config:
+            args.func(self, args)
+        else:
+            with IonAPClient(args.config, args.json, args.verbose, args.pretty) as self.api_client:
+                args.func(self, args)
+
+    def send(self, args):
+        with open(args.filename, 'rb') as infile:
+            result = self.api_client.send_document(infile, args)
+        if result:
+            print("Status: %s Transaction id %s" % (result["status"], result["transaction_id"]))
+
+    def send_sbdh(self, args):
+        with open(args.filename, 'rb') as infile:
+            result = self.api_client.send_sbdh(infile)
+        if result:
+            print("Status: %s Transaction id %s" % (result["status"], result["transaction_id"]))
+
+    def send_status(self, args):
         if args.transaction is None:
-            self.api_client.receive_list(page=args.page, page_size=args.page_size)
+            self.api_client.send_status_list(page=args.page, page_size=args.page_size, details=args.details,
+                                             pages=args.pages)
+        elif args.full and args.transaction_command is None:
+            self.api_client.send_status_full(args.transaction)
         else:
-            if args.command is None:
-                self.api_client.receive_single(args.transaction)
-            elif args.command == "document":
-                self.api_client.receive_document(args.transaction)
-            elif args.command == "receipt":
-                self.api_client.receive_receipt(args.transaction)
-            elif args.command == "metadata":
-                self.api_client.receive_metadata(args.transaction)
-            elif args.command == "delete":
-                self.api_client.receive_delete(args.transaction)
-            else:
-                print("Unknown command: %s" % args.command)
+            self.run_transaction_command(self._SEND_STATUS_COMMANDS, args)
+
+    def receive(self, args):
+        if args.transaction is None:
+            self.api_client.receive_list(page=args.page, page_size=args.page_size, details=args.details,
+                                         pages=args.pages)
+        elif args.full and args.transaction_command is None:
+            self.api_client.receive_full(args.transaction)
+        else:
+            self.run_transaction_command(self._RECEIVE_COMMANDS, args)
+
+    def run_transaction_command(self, commands, args):
+        handler = commands.get(args.transaction_command)
+        if handler is None:
+            print("Unknown command: %s" % args.transaction_command)
+        else:
+            handler(self.api_client, args.transaction)
 
-    def create_config(self):
-        self.api_client.write_default_config()
+    def create_config(self, args):
+        write_default_config_file(args.config)
 
 
 if __name__ == '__main__':